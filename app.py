@@ -2,7 +2,7 @@ import os
 import time
 import threading
 import smtplib
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session, current_app
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, send_from_directory, jsonify, session, current_app
 from flask_mail import Mail, Message
 from werkzeug.utils import secure_filename
 from datetime import datetime
@@ -13,7 +13,12 @@ from reportlab.lib.units import inch
 from reportlab.lib.colors import HexColor
 
 from config import Config
-from database import db, StudentRequest
+from database import db, StudentRequest, UploadSession
+from uploads import (OffsetMismatch, UploadTooLarge, UploadBusy, new_upload_id, staging_path, staged_offset,
+                     append_chunk, discard_upload, stage_file, move_all_into_place, purge_expired_uploads)
+from archive import stream_zip
+from search import ensure_search_index, search_students
+from profiling import init_profiling, list_profiles
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
@@ -28,12 +33,23 @@ app.config.from_object(Config)
 # Initialize extensions
 db.init_app(app)
 mail = Mail(app)
+init_profiling(app)
 
 # Initialize SendGrid client
 sg_client = SendGridAPIClient(app.config['MAIL_PASSWORD'])
 
-# Create upload folder if it doesn't exist
+# Create upload folders if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['UPLOAD_STAGING_FOLDER'], exist_ok=True)
+
+# Documents demandés dans le formulaire (nom du champ = colonne de StudentRequest)
+DOCUMENT_FIELDS = [
+    'certificat_inscription',
+    'certificat_residence',
+    'demande_manuscrite',
+    'carte_membre_reed',
+    'copie_cni'
+]
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
@@ -45,6 +61,7 @@ def index():
 @app.route('/formulaire', methods=['GET', 'POST'])
 def formulaire():
     if request.method == 'POST':
+        staged_files = []  # copies des fichiers multipart, à nettoyer en cas d'échec
         try:
             # Get form data
             nom = request.form.get('nom')
@@ -73,18 +90,21 @@ def formulaire():
                 status='pending'
             )
             
-            # Handle file uploads
-            files_required = {
-                'certificat_inscription': 'certificat_inscription',
-                'certificat_residence': 'certificat_residence', 
-                'demande_manuscrite': 'demande_manuscrite',
-                'carte_membre_reed': 'carte_membre_reed',
-                'copie_cni': 'copie_cni'
-            }
+            # Handle file uploads: un upload fractionné déjà finalisé, sinon un fichier classique
+            documents = {}
             
             # Vérifier d'abord tous les fichiers
-            for field, file_key in files_required.items():
-                file = request.files.get(file_key)
+            for field in DOCUMENT_FIELDS:
+                upload_id = request.form.get(f'{field}_upload')
+                if upload_id:
+                    upload = get_active_upload(upload_id)
+                    if not upload or not upload.completed or upload.field != field:
+                        flash(f'Le fichier {field.replace("_", " ")} est incomplet, veuillez le renvoyer', 'error')
+                        return redirect(url_for('formulaire'))
+                    documents[field] = (upload.filename, upload)  # extension enregistrée à la création
+                    continue
+                
+                file = request.files.get(field)
                 if not file or file.filename == '':
                     flash(f'Le fichier {field.replace("_", " ")} est requis', 'error')
                     return redirect(url_for('formulaire'))
@@ -92,26 +112,43 @@ def formulaire():
                 if not allowed_file(file.filename):
                     flash(f'Le fichier {field.replace("_", " ")} doit être au format PDF, PNG ou JPG', 'error')
                     return redirect(url_for('formulaire'))
+                documents[field] = (file.filename.rsplit('.', 1)[1].lower(), file)
             
-            # Sauvegarder la demande d'abord
+            # 1. Mettre les fichiers en attente AVANT toute écriture en base :
+            # sur SQLite, le verrou d'écriture n'est pas tenu pendant les copies
+            staged = {}
+            for field, (extension, source) in documents.items():
+                if isinstance(source, UploadSession):
+                    staged[field] = (extension, staging_path(source.id), source)
+                else:
+                    path = stage_file(source)
+                    staged_files.append(path)
+                    staged[field] = (extension, path, None)
+            
+            # 2. Transaction courte : insérer la demande avec ses chemins définitifs
             db.session.add(new_request)
             db.session.flush()  # Get the ID without committing
             
-            # Ensuite sauvegarder les fichiers
-            for field, file_key in files_required.items():
-                file = request.files.get(file_key)
-                if file and file.filename and allowed_file(file.filename):
-                    # Utiliser un nom de fichier simple
-                    filename = f"{new_request.id}_{field}.{file.filename.rsplit('.', 1)[1].lower()}"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    
-                    # Sauvegarder le fichier
-                    file.save(filepath)
-                    setattr(new_request, field, filename)
+            moves = []
+            for field, (extension, path, upload) in staged.items():
+                # Utiliser un nom de fichier simple
+                filename = f"{new_request.id}_{field}.{extension}"
+                setattr(new_request, field, filename)
+                moves.append((path, os.path.join(app.config['UPLOAD_FOLDER'], filename)))
+                if upload is not None:
+                    db.session.delete(upload)
             
-            # Commit toutes les données
             db.session.commit()
             
+            # 3. Mettre les fichiers en place par renommages atomiques
+            try:
+                move_all_into_place(moves)
+            except OSError:
+                # La demande pointerait vers des fichiers absents : l'annuler
+                db.session.delete(new_request)
+                db.session.commit()
+                raise
+            
             # Envoyer l'email de confirmation
             send_confirmation_email(email, nom, prenom, new_request.id)
             
@@ -120,12 +157,128 @@ def formulaire():
             
         except Exception as e:
             db.session.rollback()
+            for path in staged_files:
+                if os.path.exists(path):
+                    os.remove(path)
             app.logger.error(f'Erreur lors de la soumission: {str(e)}')
             flash('Une erreur est survenue lors de la soumission. Veuillez réessayer.', 'error')
             return redirect(url_for('formulaire'))
     
     return render_template('form.html')
 
+# API d'upload fractionné et reprenable (dans l'esprit du protocole tus)
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({'error': 'Données JSON requises'}), 400
+    
+    field = data.get('field')
+    filename = data.get('filename')
+    length = data.get('length')
+    
+    if field not in DOCUMENT_FIELDS:
+        return jsonify({'error': 'Document inconnu'}), 400
+    # Vérifier le nom d'origine : secure_filename supprimerait les noms en arabe
+    # ou en cyrillique, extension comprise
+    if not isinstance(filename, str) or not allowed_file(filename):
+        return jsonify({'error': 'Le fichier doit être au format PDF, PNG ou JPG'}), 400
+    if not isinstance(length, int) or length <= 0:
+        return jsonify({'error': 'Taille de fichier invalide'}), 400
+    if length > app.config['UPLOAD_MAX_FILE_SIZE']:
+        return jsonify({'error': 'Fichier trop volumineux (max 16MB)'}), 413
+    
+    # Nettoyer les sessions abandonnées au passage
+    purge_expired_uploads()
+    
+    # Seule l'extension sert à nommer le fichier définitif
+    extension = filename.rsplit('.', 1)[1].lower()
+    upload = UploadSession(id=new_upload_id(), field=field, filename=extension, length=length)
+    db.session.add(upload)
+    db.session.commit()
+    open(staging_path(upload.id), 'wb').close()
+    
+    response = jsonify({'id': upload.id, 'offset': 0, 'length': length})
+    response.status_code = 201
+    response.headers['Location'] = url_for('upload_chunk', upload_id=upload.id)
+    return response
+
+def get_active_upload(upload_id):
+    """Retourner la session d'upload, ou None si elle n'existe pas ou a expiré"""
+    upload = db.session.get(UploadSession, upload_id)
+    if upload is None:
+        return None
+    if upload.date_created < datetime.utcnow() - app.config['UPLOAD_SESSION_LIFETIME']:
+        return None
+    return upload
+
+def upload_offset_response(upload, offset, status=204):
+    response = app.response_class(status=status)
+    response.headers['Upload-Offset'] = str(offset)
+    response.headers['Upload-Length'] = str(upload.length)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def corrupted_upload_response(upload):
+    """Le fichier en attente dépasse la taille annoncée : la session est inutilisable"""
+    discard_upload(upload)
+    return jsonify({'error': 'Upload corrompu, veuillez recommencer l\'envoi'}), 410
+
+@app.route('/api/uploads/<upload_id>', methods=['HEAD', 'PATCH'])
+def upload_chunk(upload_id):
+    upload = get_active_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload introuvable ou expiré'}), 404
+    
+    # HEAD : le client demande où reprendre après une coupure
+    if request.method == 'HEAD':
+        offset = staged_offset(upload.id)
+        if offset > upload.length:
+            return corrupted_upload_response(upload)
+        return upload_offset_response(upload, offset, status=200)
+    
+    if upload.completed:
+        return jsonify({'error': 'Upload déjà finalisé'}), 409
+    if request.mimetype != 'application/offset+octet-stream':
+        return jsonify({'error': 'Content-Type application/offset+octet-stream requis'}), 415
+    
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'En-tête Upload-Offset requis'}), 400
+    
+    try:
+        new_offset = append_chunk(upload, request.stream, offset)
+    except OffsetMismatch as e:
+        if e.args[0] > upload.length:
+            return corrupted_upload_response(upload)
+        return jsonify({'error': 'Offset incorrect', 'offset': e.args[0]}), 409
+    except UploadTooLarge:
+        return jsonify({'error': 'Le morceau dépasse la taille annoncée'}), 413
+    except UploadBusy:
+        return jsonify({'error': 'Un morceau est déjà en cours d\'envoi, réessayez'}), 423
+    
+    return upload_offset_response(upload, new_offset)
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    upload = get_active_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload introuvable ou expiré'}), 404
+    
+    offset = staged_offset(upload.id)
+    if offset > upload.length:
+        return corrupted_upload_response(upload)
+    if offset != upload.length:
+        return jsonify({'error': 'Upload incomplet', 'offset': offset, 'length': upload.length}), 409
+    
+    if not upload.completed:
+        upload.completed = True
+        db.session.commit()
+    
+    return jsonify({'success': True, 'id': upload.id, 'field': upload.field})
+
 # Fonction pour envoyer des emails avec SendGrid (version corrigée)
 def send_email_sendgrid(to_email, subject, body, from_email=None):
     """Envoyer un email via SendGrid API"""
@@ -161,6 +314,38 @@ def send_email_async(to_email, subject, body):
     except Exception as e:
         print(f"Erreur dans send_email_async: {str(e)}")
 
+# Emails partis en arrière-plan : le worker gunicorn les attend avant de
+# s'arrêter (recyclage max_requests), voir worker_exit dans gunicorn.conf.py
+email_threads = set()
+email_threads_lock = threading.Lock()
+
+def start_email_thread(to_email, subject, body):
+    """Envoyer un email en arrière-plan dans un thread suivi"""
+    def run():
+        try:
+            send_email_async(to_email, subject, body)
+        finally:
+            with email_threads_lock:
+                email_threads.discard(thread)
+    
+    thread = threading.Thread(target=run, daemon=True)
+    with email_threads_lock:
+        email_threads.add(thread)
+    thread.start()
+    return thread
+
+def wait_for_email_threads(timeout):
+    """Attendre la fin des envois en cours, au plus timeout secondes.
+    
+    Retourne le nombre d'emails encore en cours d'envoi à l'échéance.
+    """
+    deadline = time.monotonic() + timeout
+    with email_threads_lock:
+        pending = list(email_threads)
+    for thread in pending:
+        thread.join(max(0, deadline - time.monotonic()))
+    return sum(1 for thread in pending if thread.is_alive())
+
 def send_confirmation_email(to_email, nom, prenom, request_id):
     """Envoyer un email de confirmation à l'étudiant"""
     subject = "Confirmation de réception de votre demande"
@@ -179,12 +364,7 @@ Amicale des Étudiants
     
     try:
         # Envoyer en arrière-plan
-        thread = threading.Thread(
-            target=send_email_async,
-            args=(to_email, subject, message)
-        )
-        thread.daemon = True
-        thread.start()
+        start_email_thread(to_email, subject, message)
         print(f"✓ Email de confirmation programmé pour {to_email}")
         
     except Exception as email_error:
@@ -309,12 +489,7 @@ Amicale des Étudiants
     
     try:
         # Envoyer en arrière-plan
-        thread = threading.Thread(
-            target=send_email_async,
-            args=(student.email, subject, message)
-        )
-        thread.daemon = True
-        thread.start()
+        start_email_thread(student.email, subject, message)
         print(f"✓ Email de statut programmé pour {student.email}")
     except Exception as e:
         print(f"✗ Erreur d'envoi d'email de statut: {e}")
@@ -392,12 +567,7 @@ def send_email():
                             personalized_message = personalized_message.replace('{date}', student.date_submitted.strftime('%d/%m/%Y'))
                 
                 # Envoyer en arrière-plan
-                thread = threading.Thread(
-                    target=send_email_async,
-                    args=(email, subject, personalized_message)
-                )
-                thread.daemon = True  # Thread démon pour ne pas bloquer l'arrêt
-                thread.start()
+                start_email_thread(email, subject, personalized_message)
                 sent_count += 1
                 
                 # Petite pause pour éviter le rate limiting
@@ -592,6 +762,60 @@ def download_report():
         flash(f'Erreur lors de la génération du rapport: {str(e)}', 'error')
         return redirect(url_for('admin_dashboard'))
 
+def document_entries(student_request, folder=''):
+    """Lister les documents présents sur le disque sous forme (nom dans l'archive, chemin)"""
+    entries = []
+    for field in DOCUMENT_FIELDS:
+        filename = getattr(student_request, field)
+        if not filename:
+            continue
+        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if os.path.isfile(path):
+            entries.append((folder + f"{field}.{filename.rsplit('.', 1)[1].lower()}", path))
+    return entries
+
+def zip_response(entries, download_name):
+    response = app.response_class(stream_zip(entries), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/admin/download_documents/<int:request_id>')
+def download_documents(request_id):
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('admin_login'))
+    
+    student_request = StudentRequest.query.get_or_404(request_id)
+    entries = document_entries(student_request)
+    if not entries:
+        flash('Aucun document disponible pour cette demande', 'error')
+        return redirect(url_for('view_request', request_id=request_id))
+    
+    return zip_response(entries, f"demande_{request_id}_documents.zip")
+
+@app.route('/admin/download_documents', methods=['POST'])
+def download_selected_documents():
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('admin_login'))
+    
+    selected_ids = [int(i) for i in request.form.getlist('ids') if i.isdigit()]
+    if not selected_ids:
+        flash('Veuillez sélectionner au moins une demande', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    # Les chemins sont résolus avant l'envoi : le flux ZIP n'a plus besoin de la base
+    entries = []
+    students = StudentRequest.query.filter(StudentRequest.id.in_(selected_ids)).order_by(StudentRequest.id).all()
+    for student in students:
+        folder = secure_filename(f"{student.id}_{student.nom}_{student.prenom}") + '/'
+        entries.extend(document_entries(student, folder))
+    
+    if not entries:
+        flash('Aucun document disponible pour la sélection', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    return zip_response(entries, f"documents_amicale_{datetime.now().strftime('%Y%m%d')}.zip")
+
 @app.route('/admin/email_compose')
 def email_compose():
     if not session.get('admin_logged_in'):
@@ -622,6 +846,28 @@ def api_students():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/admin/api/search')
+def api_search():
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Non autorisé'}), 401
+    
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    
+    try:
+        total, students = search_students(query, page=page, per_page=per_page)
+        return jsonify({
+            'query': query,
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': (total + per_page - 1) // per_page,
+            'results': [student.to_dict() for student in students]
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/admin/api/stats')
 def api_stats():
     if not session.get('admin_logged_in'):
@@ -638,6 +884,28 @@ def api_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/admin/profiles')
+def admin_profiles():
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('admin_login'))
+    
+    endpoint = request.args.get('endpoint') or None
+    all_profiles = list_profiles(app.config['PROFILE_DIR'])
+    profiles = [p for p in all_profiles if endpoint is None or p['endpoint'] == endpoint]
+    endpoints = sorted({p['endpoint'] for p in all_profiles})
+    
+    return render_template('admin_profiles.html',
+                         profiles=profiles,
+                         endpoints=endpoints,
+                         current_endpoint=endpoint)
+
+@app.route('/admin/profiles/<path:filename>')
+def download_profile(filename):
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('admin_login'))
+    
+    return send_from_directory(app.config['PROFILE_DIR'], filename, as_attachment=True)
+
 @app.route('/admin/logout')
 def admin_logout():
     session.pop('admin_logged_in', None)
@@ -655,6 +923,7 @@ def internal_server_error(e):
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        ensure_search_index()
         print("\n" + "="*60)
         print("APPLICATION DÉMARRÉE")
         print("="*60)
@@ -0,0 +1,58 @@
+import io
+import zipfile
+
+# Taille des blocs lus sur le disque pendant la génération de l'archive
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Tampon non « seekable » que l'on vide au fur et à mesure.
+
+    zipfile détecte qu'il ne peut pas revenir en arrière et écrit alors
+    la taille et le CRC de chaque fichier après ses données : l'archive
+    peut être envoyée au client sans fichier temporaire.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """Générer une archive ZIP à partir de (nom dans l'archive, chemin sur le disque).
+
+    Les fichiers sont stockés sans compression (PDF et JPG sont déjà
+    compressés) et lus par blocs : la mémoire utilisée ne dépend pas de
+    la taille de l'archive.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, path in entries:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zf.open(zinfo, 'w') as dest:
+                while True:
+                    block = src.read(READ_BLOCK_SIZE)
+                    if not block:
+                        break
+                    dest.write(block)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
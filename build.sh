@@ -10,7 +10,10 @@ mkdir -p templates
 # Initialiser la base de données
 python -c "
 from app import app, db
+from search import ensure_search_index
 with app.app_context():
     db.create_all()
+    if not ensure_search_index():
+        print('Index de recherche indisponible : recherche par sous-chaînes (ILIKE)')
     print('Base de données initialisée')
 "
\ No newline at end of file
@@ -15,6 +15,12 @@ class Config:
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     
+    # Resumable uploads: chunks are staged next to the final uploads so the
+    # finished file can be moved into place with an atomic rename
+    UPLOAD_STAGING_FOLDER = os.path.join(UPLOAD_FOLDER, '.staging')
+    UPLOAD_MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB max per document
+    UPLOAD_SESSION_LIFETIME = timedelta(hours=24)  # abandoned sessions are purged after this
+    
     # Mail configuration for SendGrid
     MAIL_SERVER = 'smtp.sendgrid.net'
     MAIL_PORT = 587
@@ -27,6 +33,16 @@ class Config:
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
     
+    # Profiling (opt-in): en-tête X-Profile pour un admin connecté, ou échantillonnage
+    # automatique des requêtes plus lentes que le seuil
+    PROFILE_DIR = os.path.join(basedir, 'instance', 'profiles')
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')  # 'cprofile' ou 'sampler'
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))  # 0 = désactivé
+    PROFILE_SLOW_THRESHOLD_MS = int(os.environ.get('PROFILE_SLOW_THRESHOLD_MS', '1000'))
+    PROFILE_SAMPLER_INTERVAL_MS = 5
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '50'))
+
     # Session
     PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
     
@@ -42,4 +42,17 @@ class StudentRequest(db.Model):
             'status': self.status,
             'date_submitted': self.date_submitted.strftime('%Y-%m-%d %H:%M') if self.date_submitted else None,
             'admin_notes': self.admin_notes
-        }
\ No newline at end of file
+        }
+
+class UploadSession(db.Model):
+    """Resumable upload of one document, staged until the form is submitted"""
+    id = db.Column(db.String(32), primary_key=True)
+    field = db.Column(db.String(50), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)  # lowercased extension only (pdf, png, jpg)
+    length = db.Column(db.Integer, nullable=False)
+    completed = db.Column(db.Boolean, default=False)
+    
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.field}>'
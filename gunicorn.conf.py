@@ -1,9 +1,73 @@
 # gunicorn.conf.py
+# Profil de service unique : Procfile, render.yaml, start.sh et le Dockerfile
+# lancent tous `gunicorn --config gunicorn.conf.py app:app`.
 import multiprocessing
+import os
 
-# Nombre de workers
-workers = 2
-worker_class = 'sync'
+
+def cpu_count():
+    """CPU réellement disponibles (affinité et quota cgroup du conteneur)"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = multiprocessing.cpu_count()
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+def available_memory_mb():
+    """Mémoire disponible : limite cgroup si présente, sinon MemAvailable"""
+    try:
+        with open('/sys/fs/cgroup/memory.max') as f:
+            limit = f.read().strip()
+        if limit != 'max':
+            return int(limit) // (1024 * 1024)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# Mode de service : 'sync' (par défaut) ou 'gthread' pour les chemins limités
+# par les E/S (uploads fractionnés, envoi d'emails)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+
+# Nombre de workers : selon les CPU, plafonné par la mémoire disponible
+WORKER_MEMORY_MB = int(os.environ.get('GUNICORN_WORKER_MEMORY_MB', '120'))
+
+if worker_class == 'gthread':
+    threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+    default_workers = cpu_count() + 1
+else:
+    threads = 1
+    default_workers = cpu_count() * 2 + 1
+
+memory_mb = available_memory_mb()
+if memory_mb:
+    default_workers = min(default_workers, max(1, memory_mb // WORKER_MEMORY_MB))
+
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# Charger l'application une seule fois dans le master puis forker
+preload_app = True
+
+# Recycler les workers pour limiter la croissance de la mémoire
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '100'))
 
 # Timeout augmenté
 timeout = 120  # 2 minutes au lieu de 30 secondes par défaut
@@ -15,4 +79,34 @@ errorlog = '-'
 loglevel = 'info'
 
 # Worker temp directory (pour éviter les problèmes de droits)
-worker_tmp_dir = '/dev/shm'
\ No newline at end of file
+worker_tmp_dir = '/dev/shm'
+
+
+def post_fork(server, worker):
+    # Avec preload_app, le master a importé l'application : ne pas partager
+    # ses connexions SQLAlchemy ni son client SendGrid avec les workers
+    import app as application
+    from sendgrid import SendGridAPIClient
+
+    with application.app.app_context():
+        try:
+            application.db.engine.dispose(close=False)
+        except TypeError:
+            # SQLAlchemy < 1.4.33
+            application.db.engine.dispose()
+    application.sg_client = SendGridAPIClient(application.app.config['MAIL_PASSWORD'])
+
+
+def worker_exit(server, worker):
+    # Le recyclage (max_requests) arrête le worker juste après sa dernière
+    # requête : attendre les emails envoyés en arrière-plan par les vues
+    import app as application
+
+    remaining = application.wait_for_email_threads(worker.cfg.graceful_timeout)
+    if remaining:
+        server.log.warning(f"{remaining} email(s) encore en cours d'envoi à l'arrêt du worker {worker.pid}")
+
+
+def when_ready(server):
+    server.log.info(f"Profil de service : {workers} worker(s) {worker_class}, {threads} thread(s), "
+                    f"max_requests={max_requests}±{max_requests_jitter}")
\ No newline at end of file
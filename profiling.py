@@ -0,0 +1,234 @@
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request, session
+from werkzeug.wsgi import ClosingIterator
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+class StackSampler:
+    """Profileur statistique : relève la pile d'un thread à intervalle régulier"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            # Le GIL peut retarder le réveil : pondérer par le temps réellement écoulé
+            now = time.perf_counter()
+            elapsed_ms = (now - last) * 1000
+            last = now
+
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append((stack, elapsed_ms))
+
+    def to_speedscope(self, name, duration_ms):
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        for stack, elapsed_ms in self.samples:
+            indexes = []
+            for key in stack:
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+                indexes.append(frame_index[key])
+            samples.append(indexes)
+            weights.append(round(elapsed_ms, 3))
+
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': name,
+            'exporter': 'reed-profiling',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': max(duration_ms, sum(weights)),
+                'samples': samples,
+                'weights': weights
+            }]
+        }
+
+
+def init_profiling(app):
+    """Brancher la capture de profils sur les requêtes de l'application"""
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint in (None, 'static'):
+            return
+
+        if request.headers.get(app.config['PROFILE_HEADER']) and session.get('admin_logged_in'):
+            trigger = 'header'
+            mode = request.headers.get(app.config['PROFILE_HEADER'])
+            if mode not in ('cprofile', 'sampler'):
+                mode = app.config['PROFILE_MODE']
+        elif random.random() < app.config['PROFILE_SAMPLE_RATE']:
+            # On ne sait pas encore si la requête sera lente : on capture, puis on
+            # ne garde le profil que si le seuil est dépassé
+            trigger = 'slow'
+            mode = app.config['PROFILE_MODE']
+        else:
+            return
+
+        if mode == 'sampler':
+            profiler = StackSampler(threading.get_ident(), app.config['PROFILE_SAMPLER_INTERVAL_MS'] / 1000)
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Un autre profileur est déjà actif sur ce thread
+                return
+
+        # Le contexte de requête peut avoir disparu quand un corps en streaming se termine
+        now = datetime.utcnow()
+        g.profile = {
+            'profiler': profiler,
+            'mode': mode,
+            'trigger': trigger,
+            'start': time.perf_counter(),
+            'date': now,
+            'id': f"{now.strftime('%Y%m%d_%H%M%S_%f')}_{request.endpoint}",
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path
+        }
+
+    @app.after_request
+    def stop_profile(response):
+        capture = g.pop('profile', None)
+        if capture is None:
+            return response
+
+        if response.is_streamed:
+            # Le corps (archive ZIP, fichier) est produit après after_request :
+            # arrêter la capture quand le serveur ferme l'itérateur. call_on_close
+            # ne suffit pas, werkzeug l'ignore pour send_file (direct_passthrough)
+            status_code = response.status_code
+            response.response = ClosingIterator(response.response,
+                                                lambda: finish_profile(app, capture, status_code))
+            if capture['trigger'] == 'header':
+                response.headers['X-Profile-Id'] = capture['id']
+            return response
+
+        profile_id = finish_profile(app, capture, response.status_code)
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.teardown_request
+    def stop_profile_on_error(exc):
+        # after_request n'est pas appelé si la vue lève une exception
+        finish_profile(app, g.pop('profile', None), 500)
+
+
+def finish_profile(app, capture, status_code):
+    if capture is None:
+        return None
+
+    profiler = capture['profiler']
+    duration_ms = (time.perf_counter() - capture['start']) * 1000
+    if capture['mode'] == 'sampler':
+        profiler.stop()
+    else:
+        profiler.disable()
+
+    if capture['trigger'] == 'slow' and duration_ms < app.config['PROFILE_SLOW_THRESHOLD_MS']:
+        return None
+
+    try:
+        return save_profile(app, capture, duration_ms, status_code)
+    except OSError as e:
+        app.logger.error(f'Erreur lors de l\'enregistrement du profil: {str(e)}')
+        return None
+
+
+def save_profile(app, capture, duration_ms, status_code):
+    profile_dir = app.config['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+
+    profile_id = capture['id']
+    if capture['mode'] == 'sampler':
+        filename = f'{profile_id}.speedscope.json'
+        with open(os.path.join(profile_dir, filename), 'w') as f:
+            json.dump(capture['profiler'].to_speedscope(f"{capture['method']} {capture['path']}", duration_ms), f)
+    else:
+        filename = f'{profile_id}.pstats'
+        capture['profiler'].dump_stats(os.path.join(profile_dir, filename))
+
+    meta = {
+        'id': profile_id,
+        'filename': filename,
+        'endpoint': capture['endpoint'],
+        'method': capture['method'],
+        'path': capture['path'],
+        'status': status_code,
+        'duration_ms': round(duration_ms, 1),
+        'mode': capture['mode'],
+        'trigger': capture['trigger'],
+        'date': capture['date'].strftime('%Y-%m-%d %H:%M:%S')
+    }
+    with open(os.path.join(profile_dir, f'{profile_id}.meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    prune_profiles(profile_dir, app.config['PROFILE_MAX_FILES'])
+    return profile_id
+
+
+def list_profiles(profile_dir):
+    """Profils enregistrés, du plus récent au plus ancien"""
+    if not os.path.isdir(profile_dir):
+        return []
+
+    profiles = []
+    for name in sorted(os.listdir(profile_dir), reverse=True):
+        if not name.endswith('.meta.json'):
+            continue
+        try:
+            with open(os.path.join(profile_dir, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append(meta)
+    return profiles
+
+
+def prune_profiles(profile_dir, max_files):
+    """Ne garder que les max_files captures les plus récentes"""
+    for meta in list_profiles(profile_dir)[max_files:]:
+        for name in (meta['filename'], f"{meta['id']}.meta.json"):
+            try:
+                os.remove(os.path.join(profile_dir, name))
+            except FileNotFoundError:
+                pass
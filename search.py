@@ -0,0 +1,186 @@
+import re
+import unicodedata
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from database import db, StudentRequest
+
+# Colonnes indexées pour la recherche plein texte
+SEARCH_COLUMNS = ['nom', 'prenom', 'email', 'telephone', 'adresse', 'admin_notes']
+
+# Poids BM25 (même ordre que SEARCH_COLUMNS) : l'identité compte plus que les notes
+SQLITE_WEIGHTS = '10.0, 10.0, 5.0, 5.0, 1.0, 1.0'
+
+# --- SQLite : table FTS5 tenue à jour par des triggers ---------------------
+# Le téléphone est aussi indexé sans espaces pour retrouver "771234567"
+_SQLITE_ROW = ("{p}.nom, {p}.prenom, {p}.email, "
+               "coalesce({p}.telephone, '') || ' ' || replace(coalesce({p}.telephone, ''), ' ', ''), "
+               "{p}.adresse, {p}.admin_notes")
+
+SQLITE_SETUP = [
+    """CREATE VIRTUAL TABLE student_request_fts USING fts5(
+        nom, prenom, email, telephone, adresse, admin_notes,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS student_request_fts_insert AFTER INSERT ON student_request BEGIN
+        INSERT INTO student_request_fts(rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES (new.id, {_SQLITE_ROW.format(p='new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS student_request_fts_update AFTER UPDATE ON student_request BEGIN
+        DELETE FROM student_request_fts WHERE rowid = old.id;
+        INSERT INTO student_request_fts(rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES (new.id, {_SQLITE_ROW.format(p='new')});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS student_request_fts_delete AFTER DELETE ON student_request BEGIN
+        DELETE FROM student_request_fts WHERE rowid = old.id;
+    END""",
+    # Indexer les demandes existantes
+    f"""INSERT INTO student_request_fts(rowid, {', '.join(SEARCH_COLUMNS)})
+        SELECT s.id, {_SQLITE_ROW.format(p='s')} FROM student_request s""",
+]
+
+# --- PostgreSQL : index d'expression tsvector + trigrammes ------------------
+# Les index d'expression sont mis à jour par PostgreSQL à chaque insert/update.
+_PG_DOCUMENT = ("reed_unaccent(coalesce(nom, '') || ' ' || coalesce(prenom, '') || ' ' || "
+                "coalesce(email, '') || ' ' || coalesce(telephone, '') || ' ' || "
+                "coalesce(adresse, '') || ' ' || coalesce(admin_notes, ''))")
+_PG_VECTOR = f"to_tsvector('simple', {_PG_DOCUMENT})"
+_PG_NAME = "lower(reed_unaccent(coalesce(nom, '') || ' ' || coalesce(prenom, '')))"
+
+POSTGRES_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # unaccent() n'est pas IMMUTABLE : l'envelopper pour pouvoir l'indexer
+    """CREATE OR REPLACE FUNCTION reed_unaccent(text) RETURNS text
+        AS $$ SELECT public.unaccent('public.unaccent', $1) $$
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT""",
+    f"CREATE INDEX IF NOT EXISTS ix_student_request_fts ON student_request USING GIN ({_PG_VECTOR})",
+    f"CREATE INDEX IF NOT EXISTS ix_student_request_name_trgm ON student_request USING GIN ({_PG_NAME} gin_trgm_ops)",
+]
+
+_index_ready = False
+_index_unavailable = False  # FTS5 ou extensions absentes : recherche ILIKE
+
+
+def normalize(value):
+    """Minuscules sans accents : « Éloïse » -> « eloise »"""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def search_terms(query):
+    return re.findall(r'\w+', normalize(query))
+
+
+def ensure_search_index():
+    """Créer l'index de recherche s'il n'existe pas encore (idempotent).
+
+    Retourne False si l'index ne peut pas être créé (FTS5 ou extensions
+    PostgreSQL indisponibles) : l'échec est journalisé une seule fois et la
+    recherche passe par ILIKE sans retenter le DDL à chaque requête.
+    """
+    global _index_ready, _index_unavailable
+    if _index_ready:
+        return True
+    if _index_unavailable:
+        return False
+
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as conn:
+            if dialect == 'sqlite':
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'student_request_fts'"
+                )).first()
+                if not exists:
+                    for statement in SQLITE_SETUP:
+                        conn.execute(text(statement))
+            elif dialect == 'postgresql':
+                for statement in POSTGRES_SETUP:
+                    conn.execute(text(statement))
+    except DBAPIError as e:
+        current_app.logger.error(f'Index de recherche indisponible, repli sur ILIKE: {str(e)}')
+        _index_unavailable = True
+        return False
+
+    _index_ready = True
+    return True
+
+
+def _search_sqlite(terms, limit, offset):
+    # Chaque terme est entre guillemets (pas de syntaxe FTS5 injectée) et en préfixe
+    match = ' '.join(f'"{term}"*' for term in terms)
+    total = db.session.execute(
+        text("SELECT count(*) FROM student_request_fts WHERE student_request_fts MATCH :match"),
+        {'match': match}
+    ).scalar()
+    ids = db.session.execute(
+        text(f"""SELECT rowid FROM student_request_fts
+                 WHERE student_request_fts MATCH :match
+                 ORDER BY bm25(student_request_fts, {SQLITE_WEIGHTS})
+                 LIMIT :limit OFFSET :offset"""),
+        {'match': match, 'limit': limit, 'offset': offset}
+    ).scalars().all()
+    return total, ids
+
+
+def _search_postgres(terms, limit, offset):
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    name = ' '.join(terms)
+    condition = (f"{_PG_VECTOR} @@ to_tsquery('simple', :tsquery) "
+                 f"OR {_PG_NAME} % :name")
+    params = {'tsquery': tsquery, 'name': name, 'limit': limit, 'offset': offset}
+    total = db.session.execute(
+        text(f"SELECT count(*) FROM student_request WHERE {condition}"), params
+    ).scalar()
+    ids = db.session.execute(
+        text(f"""SELECT id FROM student_request WHERE {condition}
+                 ORDER BY ts_rank({_PG_VECTOR}, to_tsquery('simple', :tsquery))
+                          + similarity({_PG_NAME}, :name) DESC, id DESC
+                 LIMIT :limit OFFSET :offset"""),
+        params
+    ).scalars().all()
+    return total, ids
+
+
+def _search_like(terms, limit, offset):
+    """Repli pour les autres bases : sous-chaînes, sans classement ni gestion des accents"""
+    query = StudentRequest.query
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(db.or_(*[getattr(StudentRequest, c).ilike(pattern) for c in SEARCH_COLUMNS]))
+    total = query.count()
+    ids = [s.id for s in query.order_by(StudentRequest.date_submitted.desc()).offset(offset).limit(limit)]
+    return total, ids
+
+
+def search_students(query, page=1, per_page=20):
+    """Rechercher des demandes, classées par pertinence.
+
+    Retourne (nombre total de résultats, demandes de la page demandée).
+    """
+    terms = search_terms(query)
+    if not terms:
+        return 0, []
+
+    offset = (page - 1) * per_page
+    dialect = db.engine.dialect.name
+    try:
+        if not ensure_search_index():
+            total, ids = _search_like(terms, per_page, offset)
+        elif dialect == 'sqlite':
+            total, ids = _search_sqlite(terms, per_page, offset)
+        elif dialect == 'postgresql':
+            total, ids = _search_postgres(terms, per_page, offset)
+        else:
+            total, ids = _search_like(terms, per_page, offset)
+    except DBAPIError:
+        # Requête plein texte en échec : repli ponctuel
+        db.session.rollback()
+        total, ids = _search_like(terms, per_page, offset)
+
+    students = {s.id: s for s in StudentRequest.query.filter(StudentRequest.id.in_(ids)).all()} if ids else {}
+    return total, [students[i] for i in ids if i in students]
@@ -5,11 +5,15 @@ echo "Starting the application..."
 
 # Initialize database
 python -c "
-from app import app, init_database
+from app import app, db
+from search import ensure_search_index
 with app.app_context():
-    init_database()
+    db.create_all()
+    if not ensure_search_index():
+        print('Search index unavailable: falling back to ILIKE search')
     print('Database initialized')
 "
 
 # Start Gunicorn
-exec gunicorn --bind 0.0.0.0:$PORT --workers 2 --threads 4 --timeout 120 app:app
\ No newline at end of file
+# (workers, threads et timeout sont définis dans gunicorn.conf.py)
+exec gunicorn --config gunicorn.conf.py app:app
\ No newline at end of file
@@ -0,0 +1,206 @@
+# tests/bench_submissions.py
+# Banc d'essai de /formulaire sous soumissions concurrentes.
+#
+# Mesure, sur une base SQLite temporaire, combien de temps le verrou d'écriture
+# est tenu (de la première écriture au commit) et le débit de soumissions, avec
+# l'ordre actuel (fichiers mis en attente avant la transaction) et avec l'ancien
+# ordre (flush, copie des fichiers, puis commit).
+#
+#     python tests/bench_submissions.py [--legacy | --current] [--submissions 40] [--threads 8] [--files-mb 4]
+import argparse
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Temps de verrou SQLite et débit de /formulaire')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--legacy', action='store_true', help='mesurer seulement l\'ancien ordre')
+    mode.add_argument('--current', action='store_true', help='mesurer seulement l\'ordre actuel')
+    parser.add_argument('--submissions', type=int, default=40, help='nombre total de soumissions')
+    parser.add_argument('--threads', type=int, default=8, help='soumissions en parallèle')
+    parser.add_argument('--files-mb', type=int, default=4, help='taille de chaque document (Mo)')
+    return parser.parse_args()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def make_legacy_view(application):
+    """Ancien formulaire : les fichiers sont copiés entre flush() et commit(),
+    le verrou d'écriture SQLite est donc tenu pendant toutes les copies"""
+    from flask import request, redirect, url_for
+    from database import db, StudentRequest
+
+    app = application.app
+
+    def legacy_formulaire():
+        try:
+            new_request = StudentRequest(
+                nom=request.form.get('nom'),
+                prenom=request.form.get('prenom'),
+                adresse=request.form.get('adresse'),
+                telephone=request.form.get('telephone'),
+                email=request.form.get('email'),
+                status='pending'
+            )
+            db.session.add(new_request)
+            db.session.flush()
+
+            for field in application.DOCUMENT_FIELDS:
+                file = request.files[field]
+                filename = f"{new_request.id}_{field}.{file.filename.rsplit('.', 1)[1].lower()}"
+                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                setattr(new_request, field, filename)
+
+            db.session.commit()
+            return redirect(url_for('index'))
+        except Exception:
+            db.session.rollback()
+            return redirect(url_for('formulaire'))
+
+    return legacy_formulaire
+
+
+def run(application, engine, mode, args, payload):
+    """Lancer les soumissions concurrentes et retourner les mesures"""
+    from database import db
+    from sqlalchemy import event
+
+    app = application.app
+    view = application.formulaire if mode == 'actuel' else make_legacy_view(application)
+    app.view_functions['formulaire'] = view
+
+    # Base et dossiers remis à zéro pour chaque mode
+    upload_folder = app.config['UPLOAD_FOLDER']
+    shutil.rmtree(upload_folder, ignore_errors=True)
+    os.makedirs(app.config['UPLOAD_STAGING_FOLDER'])
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    # Temps de verrou : de la première écriture d'une transaction à son commit
+    holds = []
+    write_started = {}
+    lock = threading.Lock()
+
+    def on_execute(conn, cursor, statement, *params):
+        if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            write_started.setdefault(id(conn), time.perf_counter())
+
+    def on_commit(conn):
+        started = write_started.pop(id(conn), None)
+        if started is not None:
+            with lock:
+                holds.append(time.perf_counter() - started)
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    event.listen(engine, 'commit', on_commit)
+
+    failures = []
+
+    def submit():
+        client = app.test_client()
+        data = {
+            'nom': 'Bench',
+            'prenom': 'Test',
+            'adresse': 'Dakar',
+            'telephone': '77 000 00 00',
+            'email': 'bench@example.com'
+        }
+        for field in application.DOCUMENT_FIELDS:
+            data[field] = (io.BytesIO(payload), f'{field}.pdf')
+        response = client.post('/formulaire', data=data, content_type='multipart/form-data')
+        if response.location != '/':
+            failures.append(response.location)
+
+    def worker(count):
+        for _ in range(count):
+            submit()
+
+    per_thread = [args.submissions // args.threads + (i < args.submissions % args.threads)
+                  for i in range(args.threads)]
+    threads = [threading.Thread(target=worker, args=(count,)) for count in per_thread]
+
+    try:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+        event.remove(engine, 'commit', on_commit)
+        app.view_functions['formulaire'] = application.formulaire
+
+    return {
+        'mode': mode,
+        'holds': holds,
+        'failures': len(failures),
+        'rate': (args.submissions - len(failures)) / elapsed
+    }
+
+
+def main():
+    args = parse_args()
+
+    # Base et dossiers temporaires : ne jamais toucher instance/amicale.db
+    workdir = tempfile.mkdtemp(prefix='reed-bench-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, BASE_DIR)
+    os.chdir(workdir)  # app.py crée static/uploads relativement au dossier courant
+
+    import app as application
+    from database import db
+
+    # Pas d'envoi d'email pendant la mesure
+    application.send_confirmation_email = lambda *params: None
+
+    app = application.app
+    app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    app.config['UPLOAD_STAGING_FOLDER'] = os.path.join(workdir, 'uploads', '.staging')
+    app.config['MAX_CONTENT_LENGTH'] = None
+
+    with app.app_context():
+        engine = db.engine
+
+    if args.legacy:
+        modes = ['ancien']
+    elif args.current:
+        modes = ['actuel']
+    else:
+        modes = ['ancien', 'actuel']
+
+    payload = os.urandom(args.files_mb * 1024 * 1024)
+    results = [run(application, engine, mode, args, payload) for mode in modes]
+
+    print(f'{args.submissions} soumissions, {args.threads} threads, '
+          f'{len(application.DOCUMENT_FIELDS)} x {args.files_mb} Mo par demande')
+    print(f"{'ordre':<8} {'verrou moyen':>13} {'verrou p95':>11} {'soumissions/s':>14} {'échecs':>7}")
+    status = 0
+    for result in results:
+        holds = result['holds']
+        if not holds:
+            print(f"{result['mode']:<8} aucune transaction mesurée")
+            status = 1
+            continue
+        print(f"{result['mode']:<8} {statistics.mean(holds) * 1000:>10.1f} ms "
+              f"{percentile(holds, 0.95) * 1000:>8.1f} ms {result['rate']:>14.1f} {result['failures']:>7}")
+        if result['failures']:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
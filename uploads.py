@@ -0,0 +1,152 @@
+import fcntl
+import os
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app
+
+from database import db, UploadSession
+
+# Taille des blocs lus depuis le flux de la requête
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class OffsetMismatch(Exception):
+    """Le client envoie un morceau à un offset différent de celui du serveur"""
+
+
+class UploadTooLarge(Exception):
+    """Le morceau dépasse la taille annoncée à la création de la session"""
+
+
+class UploadBusy(Exception):
+    """Un autre morceau est en cours d'écriture pour cette session"""
+
+
+def new_upload_id():
+    return uuid.uuid4().hex
+
+
+def staging_path(upload_id):
+    """Chemin du fichier en cours de réception"""
+    return os.path.join(current_app.config['UPLOAD_STAGING_FOLDER'], upload_id)
+
+
+def staged_offset(upload_id):
+    """Nombre d'octets déjà reçus pour cette session"""
+    try:
+        return os.path.getsize(staging_path(upload_id))
+    except OSError:
+        return 0
+
+
+def append_chunk(upload, stream, offset):
+    """Ajouter un morceau au fichier en attente et retourner le nouvel offset.
+    
+    Les octets reçus avant une coupure réseau sont conservés : le client
+    récupère l'offset avec HEAD et reprend à partir de là. Le fichier est
+    verrouillé pendant toute l'écriture : un client qui renvoie un morceau
+    pendant que le précédent est encore lu reçoit UploadBusy.
+    """
+    path = staging_path(upload.id)
+    with open(path, 'ab') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadBusy()
+        
+        # Relire la taille une fois le verrou obtenu
+        current = f.seek(0, os.SEEK_END)
+        if current != offset:
+            raise OffsetMismatch(current)
+        
+        remaining = upload.length - offset
+        try:
+            while True:
+                block = stream.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                if len(block) > remaining:
+                    raise UploadTooLarge()
+                f.write(block)
+                remaining -= len(block)
+        finally:
+            f.flush()
+            os.fsync(f.fileno())
+        
+        return f.tell()
+
+
+def discard_staged(upload_id):
+    try:
+        os.remove(staging_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def discard_upload(upload):
+    """Supprimer une session d'upload et son fichier en attente"""
+    discard_staged(upload.id)
+    db.session.delete(upload)
+    db.session.commit()
+
+
+def stage_file(file_storage):
+    """Copier un fichier reçu en multipart dans la zone d'attente"""
+    path = staging_path(new_upload_id())
+    file_storage.save(path)
+    return path
+
+
+def move_all_into_place(moves):
+    """Déplacer les fichiers (source, destination) par renommages atomiques.
+    
+    En cas d'échec, les fichiers déjà déplacés et ceux restant en attente
+    sont supprimés, puis l'erreur est relancée.
+    """
+    moved = []
+    try:
+        for src, dest in moves:
+            os.replace(src, dest)
+            moved.append(dest)
+    except OSError:
+        for path in moved + [src for src, _ in moves]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        raise
+
+
+def purge_expired_uploads():
+    """Supprimer les sessions abandonnées et leurs fichiers en attente.
+    
+    Les copies multipart de formulaire n'ont pas de session : si le worker
+    meurt avant de les nettoyer, elles sont supprimées ici une fois
+    UPLOAD_SESSION_LIFETIME écoulé.
+    """
+    lifetime = current_app.config['UPLOAD_SESSION_LIFETIME']
+    cutoff = datetime.utcnow() - lifetime
+    expired = UploadSession.query.filter(UploadSession.date_created < cutoff).all()
+    for upload in expired:
+        discard_staged(upload.id)
+        db.session.delete(upload)
+    if expired:
+        db.session.commit()
+    
+    staging_folder = current_app.config['UPLOAD_STAGING_FOLDER']
+    referenced = {upload_id for (upload_id,) in db.session.query(UploadSession.id)}
+    oldest = time.time() - lifetime.total_seconds()
+    orphans = 0
+    for name in os.listdir(staging_folder):
+        if name in referenced:
+            continue
+        path = os.path.join(staging_folder, name)
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+                orphans += 1
+        except FileNotFoundError:
+            pass
+    return len(expired) + orphans